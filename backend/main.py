@@ -1,16 +1,25 @@
 # backend/main.py (后端服务器 - FastAPI)
 
 import asyncio
-import json
 import logging
-from typing import Dict, List
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Set
 
+import numpy as np
+import orjson
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.responses import JSONResponse, HTMLResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pathfinding.core.grid import Grid
-from pathfinding.finder.a_star import AStarFinder
-from pathfinding.core.diagonal_movement import DiagonalMovement
+
+from backend.numba_astar import JIT_ENABLED, astar_numba, pack_grid_rows
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # 未安装redis客户端时只能以单进程方式运行
+    aioredis = None
 
 # --- 日志配置 ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -36,20 +45,26 @@ async def startup_event():
     logger.info("🎮 指令端点: http://localhost:8000/command/move/{npc_id}")
     logger.info("🌐 根路径: http://localhost:8000/")
     logger.info("⏰ NPC移动超时: 30秒")
+    # uvicorn在导入应用之前就已创建事件循环，应用内无法再切换，只能记录实际使用的实现；
+    # uvloop接受连接与收发帧的开销明显低于标准事件循环，可通过 --loop uvloop 显式指定
+    logger.info(f"🔁 事件循环: {type(asyncio.get_running_loop()).__module__}")
+    # 预先触发一次JIT编译（命中磁盘缓存时只需加载），避免第一条移动指令承担编译耗时
+    if JIT_ENABLED:
+        _run_astar(0, 0, 0, 0)
+        logger.info("⚙️ Numba A*寻路内核已编译")
     logger.info("✅ 后端服务已启动完成，正在监听端口 8000")
     
-    # 启动超时检查任务
-    asyncio.create_task(periodic_timeout_check())
+    # 配置了Redis时连接并同步多worker共享的游戏状态
+    await connect_redis()
+    
+    # 启动状态更新合并广播任务
+    asyncio.create_task(flush_state_updates())
 
-async def periodic_timeout_check():
-    """定期检查NPC移动超时"""
-    while True:
-        try:
-            check_movement_timeouts()
-            await asyncio.sleep(10)  # 每10秒检查一次
-        except Exception as e:
-            logger.error(f"❌ 超时检查任务失败: {e}")
-            await asyncio.sleep(10)  # 出错后等待10秒再继续
+@app.on_event("shutdown")
+async def shutdown_event():
+    """应用关闭时释放Redis连接"""
+    if REDIS is not None:
+        await REDIS.aclose()
 
 # --- 根路径欢迎页 ---
 @app.get("/", response_class=HTMLResponse)
@@ -162,76 +177,196 @@ async def root():
 class ConnectionManager:
     """管理WebSocket连接的单例类"""
     def __init__(self):
-        self.active_connections: List[WebSocket] = []
+        self.active_connections: Set[WebSocket] = set()
         self.client_connections: Dict[str, WebSocket] = {}  # client_id到WebSocket的映射
+        self._ws_to_cid: Dict[int, str] = {}  # id(WebSocket)到client_id的反向索引，断开时O(1)查找
         self.connection_counter = 0  # 用于生成唯一的client_id
 
     async def connect(self, websocket: WebSocket) -> str:
         """接受并添加一个新的WebSocket连接，返回分配的client_id"""
         await websocket.accept()
         self.connection_counter += 1
-        client_id = f"client_{self.connection_counter}_{int(time.time())}"
+        # 计数器本身已保证进程内唯一，无需再拼接时间戳格式化字符串
+        client_id = str(self.connection_counter)
         
-        self.active_connections.append(websocket)
+        self.active_connections.add(websocket)
         self.client_connections[client_id] = websocket
+        self._ws_to_cid[id(websocket)] = client_id
         
         logger.info(f"新客户端连接: {client_id}, 总连接数: {len(self.active_connections)}")
         return client_id
 
     def disconnect(self, websocket: WebSocket, client_id: str = None):
         """断开并移除一个WebSocket连接"""
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
+        self.active_connections.discard(websocket)
         
-        # 如果提供了client_id，从映射中移除
-        if client_id and client_id in self.client_connections:
-            del self.client_connections[client_id]
-        else:
-            # 如果没有提供client_id，遍历查找并移除
-            to_remove = []
-            for cid, conn in self.client_connections.items():
-                if conn == websocket:
-                    to_remove.append(cid)
-            
-            for cid in to_remove:
-                del self.client_connections[cid]
+        # 通过反向索引定位client_id，不再遍历全部连接
+        cid = self._ws_to_cid.pop(id(websocket), None)
+        if cid:
+            self.client_connections.pop(cid, None)
         
         logger.info(f"客户端断开: {client_id or 'unknown'}, 剩余连接: {len(self.active_connections)}")
 
-    async def broadcast(self, message: str):
-        """向所有连接的客户端广播消息"""
-        disconnected_connections = []
-        
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(message)
-            except RuntimeError as e:
-                # 连接已关闭，标记为需要移除
-                if "Cannot call" in str(e):
-                    disconnected_connections.append(connection)
-                else:
-                    logger.error(f"发送消息时发生错误: {e}")
-            except Exception as e:
-                logger.error(f"发送消息时发生未知错误: {e}")
-                disconnected_connections.append(connection)
+    async def broadcast(self, message: bytes):
+        """向所有连接的客户端广播消息（已序列化的UTF-8 JSON，以二进制帧发送）"""
+        # 并发发送，避免第N个客户端排队等待前N-1次发送完成；
+        # 先取快照，防止发送期间有连接加入或断开导致集合在迭代中被修改
+        connections = list(self.active_connections)
+        results = await asyncio.gather(
+            *(connection.send_bytes(message) for connection in connections),
+            return_exceptions=True,
+        )
         
-        # 移除断开的连接
-        for conn in disconnected_connections:
+        for conn, result in zip(connections, results):
+            if isinstance(result, RuntimeError):
+                # "Cannot call"表示连接已关闭，需要移除；其他运行时错误只记录
+                if "Cannot call" not in str(result):
+                    logger.error(f"发送消息时发生错误: {result}")
+                    continue
+            elif isinstance(result, Exception):
+                logger.error(f"发送消息时发生未知错误: {result}")
+            else:
+                continue
+            
+            # 移除断开的连接
             if conn in self.active_connections:
-                self.active_connections.remove(conn)
+                self.active_connections.discard(conn)
                 # 同时从client_connections中移除
-                to_remove = []
-                for cid, websocket_conn in self.client_connections.items():
-                    if websocket_conn == conn:
-                        to_remove.append(cid)
-                
-                for cid in to_remove:
-                    del self.client_connections[cid]
+                cid = self._ws_to_cid.pop(id(conn), None)
+                if cid:
+                    self.client_connections.pop(cid, None)
                 
                 logger.info(f"清理断开的连接，剩余 {len(self.active_connections)} 个连接")
 
 manager = ConnectionManager()
 
+# --- 状态更新合并广播 ---
+# 移动完成、状态重置、超时恢复等事件在高负载下会密集出现，
+# 逐个广播意味着每个事件都要对每个客户端做一次小帧写入；
+# 改为先登记待发送状态，在一个短窗口内合并后只序列化、广播一次
+STATE_FLUSH_INTERVAL = 0.015  # 合并窗口（秒）
+# 只广播状态发生变化的NPC：窗口内同一NPC多次更新只发送一次最新状态，
+# 消息大小不再随GAME_STATE中的NPC总数增长
+DIRTY_NPCS: Set[str] = set()
+STATE_DIRTY = asyncio.Event()
+
+def queue_state_update(npc_id: str):
+    """登记一个NPC的状态更新，由flush_state_updates在合并窗口结束后统一广播"""
+    DIRTY_NPCS.add(npc_id)
+    STATE_DIRTY.set()
+
+async def _broadcast_npc(npc_id: str):
+    """向所有前端广播单个NPC的最新状态"""
+    npc_update = {
+        "action": "npc_update",
+        "data": GAME_STATE[npc_id]
+    }
+    if REDIS is None:
+        await manager.broadcast(orjson.dumps(npc_update))
+        return
+    # 标记消息来源，订阅任务据此跳过本进程自己发布的状态，避免旧消息回写覆盖更新的本地状态
+    npc_update["origin"] = WORKER_ID
+    # 写入共享状态与发布消息放在同一个pipeline中，只需一次网络往返
+    async with REDIS.pipeline(transaction=False) as pipe:
+        pipe.hset(REDIS_STATE_KEY, npc_id, orjson.dumps(GAME_STATE[npc_id]))
+        pipe.publish(REDIS_CHANNEL, orjson.dumps(npc_update))
+        await pipe.execute()
+
+async def flush_state_updates():
+    """等待有待发送的状态更新，合并窗口结束后逐个广播变化的NPC"""
+    while True:
+        try:
+            await STATE_DIRTY.wait()
+            await asyncio.sleep(STATE_FLUSH_INTERVAL)
+            # 先取快照再清空，广播期间新登记的更新留到下一个窗口
+            dirty_npcs = list(DIRTY_NPCS)
+            DIRTY_NPCS.clear()
+            STATE_DIRTY.clear()
+            logger.info(f"📡 向 {len(manager.active_connections)} 个客户端广播 {len(dirty_npcs)} 个NPC的状态更新")
+            for npc_id in dirty_npcs:
+                await _broadcast_npc(npc_id)
+        except Exception as e:
+            logger.error(f"❌ 状态更新广播任务失败: {e}")
+
+# --- 多进程状态同步 (Redis) ---
+# GAME_STATE与连接管理器都在进程内存中，uvicorn开启多个worker时各进程的状态和客户端互相隔离。
+# 配置SIMVERSE_REDIS_URL后，每个NPC的状态以JSON存入同一个Redis哈希，所有广播消息发布到同一个频道，
+# 每个worker订阅一次并转发给本进程的客户端，进程内的GAME_STATE作为Redis状态的本地镜像；
+# 未配置或连接失败时保持单进程行为
+REDIS_URL = os.environ.get("SIMVERSE_REDIS_URL")
+REDIS_STATE_KEY = "simverse:game_state"  # 哈希：npc_id -> NPC状态JSON
+REDIS_CHANNEL = "simverse:state"
+REDIS = None  # 启动时连接成功后才赋值
+WORKER_ID = uuid.uuid4().hex  # 区分各worker发布的消息
+
+async def publish(message: bytes):
+    """广播一条已序列化的消息：启用Redis时发布到频道，由各worker的订阅任务转发给本地客户端"""
+    if REDIS is None:
+        await manager.broadcast(message)
+    else:
+        await REDIS.publish(REDIS_CHANNEL, message)
+
+async def connect_redis():
+    """连接Redis并同步GAME_STATE：Redis中已有的状态为准，尚不存在的NPC写入初始状态"""
+    global REDIS
+    if not REDIS_URL:
+        return
+    if aioredis is None:
+        logger.warning("⚠️ 已配置SIMVERSE_REDIS_URL但未安装redis客户端，以单进程模式运行")
+        return
+    client = aioredis.from_url(REDIS_URL)
+    try:
+        await client.ping()
+        # 多个worker同时启动时用HSETNX保证只有第一个写入初始状态
+        async with client.pipeline(transaction=False) as pipe:
+            for npc_id, npc in GAME_STATE.items():
+                pipe.hsetnx(REDIS_STATE_KEY, npc_id, orjson.dumps(npc))
+            await pipe.execute()
+        stored = await client.hgetall(REDIS_STATE_KEY)
+        for npc_id, npc_json in stored.items():
+            npc_id = npc_id.decode()
+            # 旧版本或NPC列表变更后残留的字段不属于当前游戏世界，跳过而不是中断启动
+            if npc_id not in GAME_STATE:
+                logger.warning(f"⚠️ 忽略Redis中未知的NPC状态: {npc_id}")
+                continue
+            mutate_npc(npc_id, **orjson.loads(npc_json))
+            # 所有worker重启后，遗留的walking状态不会再有人负责超时恢复，由本进程兜底
+            if GAME_STATE[npc_id]["state"] == "walking":
+                start_movement_timer(npc_id)
+    except Exception as e:
+        logger.error(f"❌ 无法连接Redis ({REDIS_URL})，以单进程模式运行: {e}")
+        await client.aclose()
+        return
+    
+    REDIS = client
+    asyncio.create_task(relay_redis_messages())
+    logger.info(f"🔗 已连接Redis，worker {WORKER_ID[:8]} 通过频道 {REDIS_CHANNEL} 同步状态")
+
+async def relay_redis_messages():
+    """订阅Redis频道：更新本地状态镜像，并把消息转发给本进程的所有客户端"""
+    while True:
+        try:
+            async with REDIS.pubsub() as pubsub:
+                await pubsub.subscribe(REDIS_CHANNEL)
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    payload = message["data"]
+                    try:
+                        update = orjson.loads(payload)
+                        if update.get("action") == "npc_update" and update.get("origin") != WORKER_ID:
+                            npc = update["data"]
+                            mutate_npc(npc["id"], **npc)
+                            # 其他worker已结束这次移动，本进程残留的超时回调不再需要
+                            if npc["state"] != "walking":
+                                cancel_movement_timer(npc["id"])
+                        await manager.broadcast(payload)
+                    except Exception as e:
+                        logger.error(f"❌ 转发Redis消息失败: {e}")
+        except Exception as e:
+            logger.error(f"❌ Redis订阅中断，1秒后重新订阅: {e}")
+            await asyncio.sleep(1)
+
 # --- 地图和障碍物定义 (基于map_with_grid.png精确标定) ---
 # 地图尺寸（基于assets/game-map.png的实际尺寸）
 MAP_WIDTH_PX = 1472
@@ -242,12 +377,7 @@ GRID_SIZE = 32
 GRID_WIDTH = MAP_WIDTH_PX // GRID_SIZE  # 结果: 46
 GRID_HEIGHT = MAP_HEIGHT_PX // GRID_SIZE  # 结果: 34
 
-# 创建二维数组表示地图网格（1=可通行, 0=障碍物）
-def create_empty_grid() -> List[List[int]]:
-    """创建一个空的地图网格，默认全部可通行"""
-    return [[1 for _ in range(GRID_WIDTH)] for _ in range(GRID_HEIGHT)]
-
-def add_rect_obstacle(matrix: List[List[int]], x: int, y: int, w: int, h: int) -> None:
+def add_rect_obstacle(matrix: np.ndarray, x: int, y: int, w: int, h: int) -> None:
     """
     在地图网格中添加矩形障碍物
     
@@ -256,12 +386,12 @@ def add_rect_obstacle(matrix: List[List[int]], x: int, y: int, w: int, h: int) -
         x, y: 矩形左上角的网格坐标
         w, h: 矩形的宽度和高度（网格单位）
     """
-    for row in range(max(0, y), min(GRID_HEIGHT, y + h)):
-        for col in range(max(0, x), min(GRID_WIDTH, x + w)):
-            matrix[row][col] = 0  # 标记为障碍物
+    # 切片赋值在C层一次性完成整块填充，越界部分由切片边界截断
+    matrix[max(0, y):min(GRID_HEIGHT, y + h), max(0, x):min(GRID_WIDTH, x + w)] = 0  # 标记为障碍物
 
-# 创建地图网格并标记障碍物
-MAP_GRID = create_empty_grid()
+# 创建地图网格并标记障碍物（1=可通行, 0=障碍物）
+# 使用连续的uint8数组而非嵌套列表：整张地图只占一块连续内存，便于后续寻路直接复用
+MAP_GRID = np.ones((GRID_HEIGHT, GRID_WIDTH), dtype=np.uint8)
 
 # === 精确障碍物定义 (基于map_with_grid.png施工图) ===
 
@@ -368,17 +498,258 @@ GAME_STATE: Dict[str, Dict] = {
     "npc_5": {"id": "npc_5", "name": "向导", "x": 400, "y": 200, "type": "npc", "state": "idle"},
 }
 
+def mutate_npc(npc_id: str, **changes) -> None:
+    """修改NPC状态的唯一入口，便于集中处理状态变化"""
+    GAME_STATE[npc_id].update(changes)
+
 # --- A*寻路系统初始化 ---
-# 使用地图网格初始化寻路网格
-PATH_GRID = Grid(matrix=MAP_GRID)
-# 创建A*寻路器，允许对角线移动
-FINDER = AStarFinder(diagonal_movement=DiagonalMovement.always)
+# 寻路由同一份A*内核完成：安装numba时JIT编译执行，否则以纯Python方式执行，路径完全一致。
+# 不再使用pyastar2d：它的对角线步长代价为1，返回的路径按欧氏长度常常明显绕远
+# A*内核使用的位压缩地图：地图宽46格，每行正好放进一个uint64，整张地图只有272字节
+PACKED_GRID = pack_grid_rows(MAP_GRID)
+# --- 矩形对称性消减(RSR)预处理 ---
+# 地图大部分是障碍物之间的大块空地，A*会为空地内部每个等价的格子付出展开代价。
+# 把可通行区域分解为空矩形后，矩形内部格子不再参与展开，
+# 改由周长格子之间的"宏边"直接跨越矩形，最短路径长度保持不变
+def _largest_free_rectangle(free: np.ndarray) -> tuple[int, int, int, int]:
+    """用逐行柱状图+单调栈求free中面积最大的全True矩形，返回(x0, y0, x1, y1)闭区间"""
+    height, width = free.shape
+    heights = np.zeros(width, dtype=np.int32)
+    best_area, best_rect = 0, (0, 0, 0, 0)
+    for y in range(height):
+        heights = np.where(free[y], heights + 1, 0)
+        column_heights = heights.tolist() + [0]
+        stack: List[tuple[int, int]] = []  # (起始列, 柱高)
+        for x, h in enumerate(column_heights):
+            start = x
+            while stack and stack[-1][1] >= h:
+                start, top = stack.pop()
+                if top * (x - start) > best_area:
+                    best_area = top * (x - start)
+                    best_rect = (start, y - top + 1, x - 1, y)
+            stack.append((start, h))
+    return best_rect
+
+def decompose_free_rectangles(grid: np.ndarray) -> tuple[List[tuple[int, int, int, int]], np.ndarray]:
+    """
+    贪心地将可通行区域分解为互不重叠的空矩形
+
+    每次取剩余空地中面积最大的矩形，比逐行扫描得到的细长条带拥有更多内部格子
+
+    参数:
+        grid: 地图网格（1=可通行, 0=障碍物）
+
+    返回:
+        rects: 每个矩形的(x0, y0, x1, y1)，均为闭区间网格坐标
+        cell_to_rect: 每个格子所属矩形的编号，障碍物为-1
+    """
+    free = grid == 1
+    cell_to_rect = np.full(grid.shape, -1, dtype=np.int32)
+    rects: List[tuple[int, int, int, int]] = []
+    while free.any():
+        x0, y0, x1, y1 = _largest_free_rectangle(free)
+        free[y0:y1 + 1, x0:x1 + 1] = False
+        cell_to_rect[y0:y1 + 1, x0:x1 + 1] = len(rects)
+        rects.append((x0, y0, x1, y1))
+    return rects, cell_to_rect
+
+def rect_perimeter(rect: tuple[int, int, int, int]) -> tuple[tuple[int, int], ...]:
+    """按顺时针顺序返回矩形周长上的所有格子坐标(x, y)"""
+    x0, y0, x1, y1 = rect
+    top = [(x, y0) for x in range(x0, x1 + 1)]
+    right = [(x1, y) for y in range(y0 + 1, y1 + 1)]
+    bottom = [(x, y1) for x in range(x1 - 1, x0 - 1, -1)]
+    left = [(x0, y) for y in range(y1 - 1, y0, -1)]
+    return tuple(top + right + bottom + left)
+
+def expand_macro_path(path: Sequence[tuple[int, int]]) -> List[tuple[int, int]]:
+    """
+    将包含宏边的路径展开为逐格路径
+
+    宏边两端位于同一个空矩形内，先走对角线再走直线的八方向路径
+    不会离开两端点的包围盒，因此一定无障碍，且长度等于八方向距离
+    """
+    if not path:
+        return []
+    expanded = [path[0]]
+    for tx, ty in path[1:]:
+        x, y = expanded[-1]
+        # 路径中大部分是普通的相邻移动，无需逐步展开
+        if -1 <= tx - x <= 1 and -1 <= ty - y <= 1:
+            expanded.append((tx, ty))
+            continue
+        while (x, y) != (tx, ty):
+            x += (tx > x) - (tx < x)
+            y += (ty > y) - (ty < y)
+            expanded.append((x, y))
+    return expanded
+
+def build_rsr_graph(grid: np.ndarray, rects: List[tuple[int, int, int, int]]
+                    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    构建RSR剪枝后的宏边表，供A*内核使用
+
+    普通邻居为八方向可通行且不在矩形内部的格子（与DiagonalMovement.always一致，允许切角），
+    由内核直接在位压缩地图上判断，这里只生成跨越矩形的宏边：
+    周长格子连向对边上45°锥形范围内的格子，以及两条向内45°射线的落点，
+    其余周长格子都能先沿周长直走、再经这些宏边以相同代价到达。
+    内部格子（只会作为起点被展开）直接连向整个周长。
+
+    返回:
+        interior: 矩形内部格子掩码
+        jump_offsets, jump_targets: CSR格式的宏边表，格子与目标均按y * width + x编号，
+            格子i的宏边目标为jump_targets[jump_offsets[i]:jump_offsets[i + 1]]
+    """
+    height, width = grid.shape
+    interior = np.zeros((height, width), dtype=bool)
+    macro: List[set] = [set() for _ in range(width * height)]
+    for x0, y0, x1, y1 in rects:
+        # 宽和高都不小于3的矩形才有内部格子，其余矩形无需宏边
+        if x1 - x0 < 2 or y1 - y0 < 2:
+            continue
+        interior[y0 + 1:y1, x0 + 1:x1] = True
+        perimeter = rect_perimeter((x0, y0, x1, y1))
+        for px, py in perimeter:
+            targets = macro[py * width + px]
+            if px in (x0, x1):
+                # 左右两边：连向对边纵向偏移不超过矩形宽度的格子
+                ox, span = (x1 if px == x0 else x0), x1 - x0
+                targets.update((ox, y) for y in range(max(y0, py - span), min(y1, py + span) + 1))
+            if py in (y0, y1):
+                oy, span = (y1 if py == y0 else y0), y1 - y0
+                targets.update((x, oy) for x in range(max(x0, px - span), min(x1, px + span) + 1))
+            for dx in (-1, 1):
+                for dy in (-1, 1):
+                    # 向内的45°射线一直走到再次碰到周长为止
+                    x, y = px + dx, py + dy
+                    if not (x0 < x < x1 and y0 < y < y1):
+                        continue
+                    while x0 < x < x1 and y0 < y < y1:
+                        x, y = x + dx, y + dy
+                    targets.add((x, y))
+        for iy in range(y0 + 1, y1):
+            for ix in range(x0 + 1, x1):
+                macro[iy * width + ix].update(perimeter)
+
+    jump_offsets = np.zeros(width * height + 1, dtype=np.int32)
+    jump_targets: List[int] = []
+    for index, targets in enumerate(macro):
+        y, x = divmod(index, width)
+        # 相邻的宏边目标已经是普通邻居，无需重复
+        jump_targets.extend(sorted(ty * width + tx for tx, ty in targets if abs(tx - x) > 1 or abs(ty - y) > 1))
+        jump_offsets[index + 1] = len(jump_targets)
+    return interior, jump_offsets, np.asarray(jump_targets, dtype=np.int32)
+
+RECTS, CELL_TO_RECT = decompose_free_rectangles(MAP_GRID)
+RECT_INTERIOR, RSR_JUMP_OFFSETS, RSR_JUMP_TARGETS = build_rsr_graph(MAP_GRID, RECTS)
+# 去掉矩形内部格子后的位压缩地图：内核的普通相邻移动只会走到这些格子
+PACKED_OPEN_GRID = pack_grid_rows(np.where(RECT_INTERIOR, 0, MAP_GRID))
+# 内核按y * width + x索引所属矩形
+RSR_CELL_TO_RECT = np.ascontiguousarray(CELL_TO_RECT.ravel())
+
+def _run_astar(sx: int, sy: int, tx: int, ty: int) -> List[tuple[int, int]]:
+    """调用A*内核并把含宏边的(row, col)结果展开为逐格的(x, y)路径，无可行路径时返回空列表"""
+    path_arr = astar_numba(PACKED_GRID, PACKED_OPEN_GRID, RSR_CELL_TO_RECT,
+                           RSR_JUMP_OFFSETS, RSR_JUMP_TARGETS, GRID_WIDTH, sy, sx, ty, tx)
+    return expand_macro_path([(col, row) for row, col in path_arr.tolist()])
+
+# 寻路线程数
+PATH_WORKERS = 2
+
+# 直线检测逐格做位测试，Python整数的移位比逐个索引numpy数组快得多
+_PACKED_ROWS = [int(row) for row in PACKED_GRID]
+
+def _line_clear(sx: int, sy: int, tx: int, ty: int) -> Optional[List[tuple[int, int]]]:
+    """
+    检查起点与终点格子中心之间的直线是否无障碍，无障碍时直接返回两点路径
+
+    前端在相邻路径点之间做直线插值，因此逐格检查线段实际经过的每一个格子（而不仅是
+    Bresenham选出的细线格子），保证动画不会穿过障碍物；线段恰好经过格子顶点时
+    按对角线移动处理，与A*允许切角的规则一致。直线长度不超过八方向最短路径，结果仍是最优的
+
+    参数:
+        sx, sy: 起点网格坐标
+        tx, ty: 终点网格坐标
+
+    返回:
+        [(sx, sy), (tx, ty)]（起点即终点时为[(sx, sy)]）；直线被障碍物阻挡时返回None
+    """
+    rows = _PACKED_ROWS
+    if not (rows[sy] >> sx) & 1:
+        return None
+    # 起点即终点时与A*一致只返回单个点，避免前端收到重复的路径点
+    if sx == tx and sy == ty:
+        return [(sx, sy)]
+    nx, ny = abs(tx - sx), abs(ty - sy)
+    step_x = 1 if tx > sx else -1
+    step_y = 1 if ty > sy else -1
+    x, y = sx, sy
+    ix = iy = 0
+    while ix < nx or iy < ny:
+        # 比较线段先穿过竖直边界还是水平边界（整数运算，避免浮点误差）
+        decision = (1 + 2 * ix) * ny - (1 + 2 * iy) * nx
+        if decision == 0:
+            x += step_x
+            y += step_y
+            ix += 1
+            iy += 1
+        elif decision < 0:
+            x += step_x
+            ix += 1
+        else:
+            y += step_y
+            iy += 1
+        if not (rows[y] >> x) & 1:
+            return None
+    return [(sx, sy), (tx, ty)]
+
+def find_grid_path(start_grid_x: int, start_grid_y: int,
+                   target_grid_x: int, target_grid_y: int) -> List[tuple[int, int]]:
+    """
+    在地图网格上执行A*寻路，允许对角线移动
+
+    参数:
+        start_grid_x, start_grid_y: 起点网格坐标
+        target_grid_x, target_grid_y: 终点网格坐标
+
+    返回:
+        网格坐标路径列表（包含起点和终点），无可行路径时返回空列表
+    """
+    # 空旷地图上大量随机目标可以直线到达，无需执行A*
+    line_path = _line_clear(start_grid_x, start_grid_y, target_grid_x, target_grid_y)
+    if line_path is not None:
+        return line_path
+    
+    return _run_astar(start_grid_x, start_grid_y, target_grid_x, target_grid_y)
+
+# MAP_GRID在运行期间不会变化，相同起终点的路径结果可以直接复用；
+# 控制器在固定的坐标空间内随机选点，重复的(起点, 终点)组合很常见
+# 返回元组以保证缓存结果不可变，调用方无法意外修改共享的缓存值
+@lru_cache(maxsize=4096)
+def _find_path_cached(sx: int, sy: int, tx: int, ty: int) -> tuple[tuple[int, int], ...]:
+    """带LRU缓存的网格寻路，参数与find_grid_path一致"""
+    return tuple(find_grid_path(sx, sy, tx, ty))
+
+# 寻路专用线程池：JIT编译的内核以nogil方式执行，期间会释放GIL，
+# 寻路因此可以与事件循环真正并行
+_PATH_POOL = ThreadPoolExecutor(max_workers=PATH_WORKERS, thread_name_prefix="astar")
+
+def _compute_path(sx: int, sy: int, tx: int, ty: int) -> List[Dict[str, int]]:
+    """在寻路线程池中执行：查找网格路径并转换为像素坐标路径，无可行路径时返回空列表"""
+    return convert_path_to_pixels(_find_path_cached(sx, sy, tx, ty))
+
+def path_cache_hit_rate() -> float:
+    """返回路径缓存的累计命中率，用于日志观察缓存效果"""
+    info = _find_path_cached.cache_info()
+    total = info.hits + info.misses
+    return info.hits / total if total else 0.0
 
 # --- NPC状态超时管理 ---
 # NPC移动超时时间（秒）
 MOVEMENT_TIMEOUT = 30  # 30秒后自动重置状态
-# NPC状态开始时间记录
-NPC_STATE_START_TIMES: Dict[str, float] = {}
+# 每个移动中NPC的超时回调：开始移动时登记，移动完成或重置时取消，
+# 没有NPC在移动时不产生任何周期性开销，且超时时刻精确
+NPC_TIMERS: Dict[str, asyncio.TimerHandle] = {}
 
 def pixel_to_grid(x: int, y: int) -> tuple[int, int]:
     """将像素坐标转换为网格坐标"""
@@ -386,53 +757,56 @@ def pixel_to_grid(x: int, y: int) -> tuple[int, int]:
     grid_y = y // GRID_SIZE
     return grid_x, grid_y
 
+def clamp_to_grid(grid_x: int, grid_y: int) -> tuple[int, int]:
+    """将网格坐标限制在地图范围内（标量场景下内置min/max比np.clip更快）"""
+    return min(max(grid_x, 0), GRID_WIDTH - 1), min(max(grid_y, 0), GRID_HEIGHT - 1)
+
 def grid_to_pixel(grid_x: int, grid_y: int) -> tuple[int, int]:
     """将网格坐标转换为像素坐标（转换为网格中心点）"""
     pixel_x = grid_x * GRID_SIZE + GRID_SIZE // 2
     pixel_y = grid_y * GRID_SIZE + GRID_SIZE // 2
     return pixel_x, pixel_y
 
-def convert_path_to_pixels(path: List[tuple[int, int]]) -> List[Dict[str, int]]:
+def convert_path_to_pixels(path: Sequence[tuple[int, int]]) -> List[Dict[str, int]]:
     """
     将网格坐标路径转换为像素坐标路径
     
     参数:
-        path: 网格坐标路径列表
+        path: 网格坐标路径，每个点为(x, y)
         
     返回:
         像素坐标路径列表，每个点包含x和y坐标
     """
-    pixel_path = []
-    for grid_x, grid_y in path:
-        pixel_x, pixel_y = grid_to_pixel(grid_x, grid_y)
-        pixel_path.append({"x": pixel_x, "y": pixel_y})
-    return pixel_path
+    if not path:
+        return []
+    # 整条路径一次性做向量化换算（与grid_to_pixel相同，取网格中心点），
+    # tolist()直接产出Python int，可被json直接序列化
+    pixels = np.asarray(path, dtype=np.int32) * GRID_SIZE + GRID_SIZE // 2
+    return [{"x": pixel_x, "y": pixel_y} for pixel_x, pixel_y in pixels.tolist()]
+
+def start_movement_timer(npc_id: str) -> None:
+    """NPC开始移动时登记超时回调，替换该NPC可能残留的旧回调"""
+    cancel_movement_timer(npc_id)
+    loop = asyncio.get_running_loop()
+    NPC_TIMERS[npc_id] = loop.call_later(MOVEMENT_TIMEOUT, expire_movement, npc_id)
 
-import time
+def cancel_movement_timer(npc_id: str) -> None:
+    """取消NPC的移动超时回调（如果存在）"""
+    timer = NPC_TIMERS.pop(npc_id, None)
+    if timer is not None:
+        timer.cancel()
 
-def check_movement_timeouts():
+def expire_movement(npc_id: str) -> None:
     """
-    检查NPC移动超时并自动重置状态
+    移动超时回调：到期仍未收到移动完成事件时自动重置NPC状态
     """
-    current_time = time.time()
-    timed_out_npcs = []
-    
-    for npc_id, start_time in NPC_STATE_START_TIMES.items():
-        if current_time - start_time > MOVEMENT_TIMEOUT:
-            timed_out_npcs.append(npc_id)
-    
-    for npc_id in timed_out_npcs:
-        if npc_id in GAME_STATE and GAME_STATE[npc_id]["state"] == "walking":
-            logger.warning(f"⏰ NPC {npc_id} 移动超时({MOVEMENT_TIMEOUT}秒)，自动重置状态")
-            GAME_STATE[npc_id]["state"] = "idle"
-            del NPC_STATE_START_TIMES[npc_id]
-            
-            # 广播状态更新
-            state_update = {
-                "action": "state_update",
-                "data": GAME_STATE
-            }
-            asyncio.create_task(manager.broadcast(json.dumps(state_update)))
+    NPC_TIMERS.pop(npc_id, None)
+    if npc_id in GAME_STATE and GAME_STATE[npc_id]["state"] == "walking":
+        logger.warning(f"⏰ NPC {npc_id} 移动超时({MOVEMENT_TIMEOUT}秒)，自动重置状态")
+        mutate_npc(npc_id, state="idle")
+        
+        # 登记状态更新，由合并广播任务统一发送
+        queue_state_update(npc_id)
 
 # --- WebSocket 端点 ---
 @app.websocket("/ws")
@@ -447,13 +821,18 @@ async def websocket_endpoint(websocket: WebSocket):
         "message": "成功连接到SimVerse Engine",
         "game_state": GAME_STATE
     }
-    await websocket.send_text(json.dumps(connection_message))
+    await websocket.send_bytes(orjson.dumps(connection_message))
     
     try:
         while True:
-            # 接收来自客户端的消息
-            data = await websocket.receive_text()
-            message = json.loads(data)
+            # 接收来自客户端的消息：支持二进制帧，同时兼容现有前端发送的文本帧
+            raw = await websocket.receive()
+            if raw["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(raw.get("code", 1000))
+            data = raw.get("bytes")
+            if data is None:
+                data = raw["text"]
+            message = orjson.loads(data)
             
             # 处理来自前端的移动完成事件
             if message.get("event") == "move_complete":
@@ -484,20 +863,12 @@ async def handle_move_complete(npc_id: str):
     logger.info(f"✅ 收到NPC {npc_name} ({npc_id}) 的移动完成事件")
     
     # 将NPC状态恢复为idle
-    npc["state"] = "idle"
-    # 清理状态时间记录
-    if npc_id in NPC_STATE_START_TIMES:
-        del NPC_STATE_START_TIMES[npc_id]
+    mutate_npc(npc_id, state="idle")
+    # 取消移动超时回调
+    cancel_movement_timer(npc_id)
     
-    # 构建状态更新消息
-    state_update = {
-        "action": "state_update",
-        "data": GAME_STATE
-    }
-    
-    # 向所有前端广播状态更新
-    logger.info(f"📡 向 {len(manager.active_connections)} 个客户端广播状态更新")
-    await manager.broadcast(json.dumps(state_update))
+    # 登记状态更新，由合并广播任务统一发送给所有前端
+    queue_state_update(npc_id)
 
 # --- 状态管理API端点 ---
 @app.post("/admin/reset_npc_state/{npc_id}")
@@ -511,19 +882,14 @@ async def reset_npc_state(npc_id: str):
     
     npc = GAME_STATE[npc_id]
     old_state = npc["state"]
-    npc["state"] = "idle"
-    # 清理状态时间记录
-    if npc_id in NPC_STATE_START_TIMES:
-        del NPC_STATE_START_TIMES[npc_id]
+    mutate_npc(npc_id, state="idle")
+    # 取消移动超时回调
+    cancel_movement_timer(npc_id)
     
     logger.info(f"🔧 重置NPC {npc['name']} ({npc_id}) 状态: {old_state} → idle")
     
-    # 广播状态更新
-    state_update = {
-        "action": "state_update",
-        "data": GAME_STATE
-    }
-    await manager.broadcast(json.dumps(state_update))
+    # 登记状态更新，由合并广播任务统一发送
+    queue_state_update(npc_id)
     
     return JSONResponse(status_code=200, content={"message": f"NPC {npc['name']} 状态已重置为idle"})
 
@@ -554,11 +920,14 @@ class InteractiveMoveCommand(BaseModel):
     target_x: int
     target_y: int
 
-@app.post("/command/move/{npc_id}")
-async def move_npc(npc_id: str, command: MoveCommand):
+async def _do_move(npc_id: str, target_x: int, target_y: int, command_name: str) -> JSONResponse:
     """
-    接收来自控制器（模拟手机端）的移动指令
-    使用A*算法进行路径查找，然后向前端发送路径指令执行动画
+    两个移动指令端点共用的处理流程：校验NPC状态、寻路、广播路径指令
+
+    参数:
+        npc_id: 要移动的NPC ID
+        target_x, target_y: 目标像素坐标
+        command_name: 指令名称，仅用于日志区分指令来源
     """
     # 检查NPC是否存在
     if npc_id not in GAME_STATE:
@@ -579,34 +948,40 @@ async def move_npc(npc_id: str, command: MoveCommand):
     try:
         # 将像素坐标转换为网格坐标
         start_grid_x, start_grid_y = pixel_to_grid(npc["x"], npc["y"])
-        target_grid_x, target_grid_y = pixel_to_grid(command.target_x, command.target_y)
+        target_grid_x, target_grid_y = pixel_to_grid(target_x, target_y)
         
         # 边界检查
-        start_grid_x = max(0, min(GRID_WIDTH - 1, start_grid_x))
-        start_grid_y = max(0, min(GRID_HEIGHT - 1, start_grid_y))
-        target_grid_x = max(0, min(GRID_WIDTH - 1, target_grid_x))
-        target_grid_y = max(0, min(GRID_HEIGHT - 1, target_grid_y))
+        start_grid_x, start_grid_y = clamp_to_grid(start_grid_x, start_grid_y)
+        target_grid_x, target_grid_y = clamp_to_grid(target_grid_x, target_grid_y)
         
-        logger.info(f"🎮 收到移动指令: {npc_name} ({npc_id})")
-        logger.info(f"📍 像素坐标: ({npc['x']}, {npc['y']}) → ({command.target_x}, {command.target_y})")
+        logger.info(f"🎮 收到{command_name}: {npc_name} ({npc_id})")
+        logger.info(f"📍 像素坐标: ({npc['x']}, {npc['y']}) → ({target_x}, {target_y})")
         logger.info(f"🗂️ 网格坐标: ({start_grid_x}, {start_grid_y}) → ({target_grid_x}, {target_grid_y})")
         
-        # 使用A*算法查找路径
-        start_node = PATH_GRID.node(start_grid_x, start_grid_y)
-        end_node = PATH_GRID.node(target_grid_x, target_grid_y)
+        # 使用A*算法查找路径，并转换为像素坐标路径
+        # 寻路是CPU密集计算，放到线程池中执行，避免阻塞事件循环上的WebSocket收发
+        loop = asyncio.get_running_loop()
+        pixel_path = await loop.run_in_executor(
+            _PATH_POOL, _compute_path, start_grid_x, start_grid_y, target_grid_x, target_grid_y
+        )
         
-        path, runs = FINDER.find_path(start_node, end_node, PATH_GRID)
+        # 等待寻路期间，可能已有另一条指令让该NPC开始移动
+        if npc["state"] != "idle":
+            logger.warning(f"❌ NPC {npc_name} ({npc_id}) 在寻路期间已开始移动，放弃本次指令")
+            return JSONResponse(
+                status_code=409, 
+                content={"message": f"错误: NPC {npc_name} 正在移动中，请等待完成"}
+            )
         
-        if path:
-            logger.info(f"🛤️ A*寻路成功: 找到包含{len(path)}个节点的路径，耗时{runs}次运行")
-            
-            # 将网格坐标路径转换为像素坐标路径
-            pixel_path = convert_path_to_pixels(path)
+        if pixel_path:
+            logger.info(f"🛤️ A*寻路成功: 找到包含{len(pixel_path)}个节点的路径（路径缓存命中率 {path_cache_hit_rate():.0%}）")
             
             # 将NPC状态设置为walking（表示正在执行动画）
-            npc["state"] = "walking"
-            # 记录状态开始时间
-            NPC_STATE_START_TIMES[npc_id] = time.time()
+            mutate_npc(npc_id, state="walking")
+            # 登记状态更新，让前端与其他worker得知该NPC正在移动
+            queue_state_update(npc_id)
+            # 登记移动超时回调
+            start_movement_timer(npc_id)
             
             # 构建路径指令消息
             path_command = {
@@ -619,13 +994,13 @@ async def move_npc(npc_id: str, command: MoveCommand):
             
             # 向所有前端广播路径指令
             logger.info(f"📡 向 {len(manager.active_connections)} 个客户端广播路径指令")
-            await manager.broadcast(json.dumps(path_command))
+            await publish(orjson.dumps(path_command))
             
             return JSONResponse(
                 status_code=200, 
                 content={
-                    "message": f"指令已执行: {npc_name} 开始沿路径移动到 ({command.target_x}, {command.target_y})",
-                    "path_length": len(path),
+                    "message": f"指令已执行: {npc_name} 开始沿路径移动到 ({target_x}, {target_y})",
+                    "path_length": len(pixel_path),
                     "action": "path_command_sent"
                 }
             )
@@ -637,105 +1012,27 @@ async def move_npc(npc_id: str, command: MoveCommand):
             )
             
     except Exception as e:
-        logger.error(f"❌ 移动指令处理失败: {str(e)}")
+        logger.error(f"❌ {command_name}处理失败: {str(e)}")
         # 确保NPC状态恢复为idle
         if npc_id in GAME_STATE:
-            GAME_STATE[npc_id]["state"] = "idle"
+            mutate_npc(npc_id, state="idle")
         return JSONResponse(
             status_code=500,
             content={"message": f"内部错误: 移动指令处理失败"}
         )
 
+@app.post("/command/move/{npc_id}")
+async def move_npc(npc_id: str, command: MoveCommand):
+    """
+    接收来自控制器（模拟手机端）的移动指令
+    使用A*算法进行路径查找，然后向前端发送路径指令执行动画
+    """
+    return await _do_move(npc_id, command.target_x, command.target_y, "移动指令")
+
 @app.post("/command/interactive_move")
 async def interactive_move_npc(command: InteractiveMoveCommand):
     """
     交互式移动指令端点，用于Web控制器
     接收包含npc_id、target_x和target_y的完整移动指令
     """
-    npc_id = command.npc_id
-    
-    # 检查NPC是否存在
-    if npc_id not in GAME_STATE:
-        logger.warning(f"❌ 无效的NPC ID: '{npc_id}'，当前可用的NPC: {list(GAME_STATE.keys())}")
-        return JSONResponse(status_code=404, content={"message": f"错误: NPC ID '{npc_id}' 不存在"})
-    
-    npc = GAME_STATE[npc_id]
-    npc_name = npc["name"]
-    
-    # 检查NPC状态是否为idle
-    if npc["state"] != "idle":
-        logger.warning(f"❌ NPC {npc_name} ({npc_id}) 当前状态为 '{npc['state']}'，无法执行移动指令")
-        return JSONResponse(
-            status_code=409, 
-            content={"message": f"错误: NPC {npc_name} 正在移动中，请等待完成"}
-        )
-    
-    try:
-        # 将像素坐标转换为网格坐标
-        start_grid_x, start_grid_y = pixel_to_grid(npc["x"], npc["y"])
-        target_grid_x, target_grid_y = pixel_to_grid(command.target_x, command.target_y)
-        
-        # 边界检查
-        start_grid_x = max(0, min(GRID_WIDTH - 1, start_grid_x))
-        start_grid_y = max(0, min(GRID_HEIGHT - 1, start_grid_y))
-        target_grid_x = max(0, min(GRID_WIDTH - 1, target_grid_x))
-        target_grid_y = max(0, min(GRID_HEIGHT - 1, target_grid_y))
-        
-        logger.info(f"🎮 收到交互式移动指令: {npc_name} ({npc_id})")
-        logger.info(f"📍 像素坐标: ({npc['x']}, {npc['y']}) → ({command.target_x}, {command.target_y})")
-        logger.info(f"🗂️ 网格坐标: ({start_grid_x}, {start_grid_y}) → ({target_grid_x}, {target_grid_y})")
-        
-        # 使用A*算法查找路径
-        start_node = PATH_GRID.node(start_grid_x, start_grid_y)
-        end_node = PATH_GRID.node(target_grid_x, target_grid_y)
-        
-        path, runs = FINDER.find_path(start_node, end_node, PATH_GRID)
-        
-        if path:
-            logger.info(f"🛤️ A*寻路成功: 找到包含{len(path)}个节点的路径，耗时{runs}次运行")
-            
-            # 将网格坐标路径转换为像素坐标路径
-            pixel_path = convert_path_to_pixels(path)
-            
-            # 将NPC状态设置为walking（表示正在执行动画）
-            npc["state"] = "walking"
-            # 记录状态开始时间
-            NPC_STATE_START_TIMES[npc_id] = time.time()
-            
-            # 构建路径指令消息
-            path_command = {
-                "action": "move_along_path",
-                "data": {
-                    "npc_id": npc_id,
-                    "path": pixel_path
-                }
-            }
-            
-            # 向所有前端广播路径指令
-            logger.info(f"📡 向 {len(manager.active_connections)} 个客户端广播路径指令")
-            await manager.broadcast(json.dumps(path_command))
-            
-            return JSONResponse(
-                status_code=200, 
-                content={
-                    "message": f"指令已执行: {npc_name} 开始沿路径移动到 ({command.target_x}, {command.target_y})",
-                    "path_length": len(path),
-                    "action": "path_command_sent"
-                }
-            )
-        else:
-            logger.warning(f"❌ A*寻路失败: 无法从 ({start_grid_x}, {start_grid_y}) 到达 ({target_grid_x}, {target_grid_y})")
-            return JSONResponse(
-                status_code=400,
-                content={"message": f"错误: 无法找到从当前位置到目标位置的可行路径"}
-            )
-            
-    except Exception as e:
-        logger.error(f"❌ 交互式移动指令处理失败: {str(e)}")
-        # 确保NPC状态恢复为idle
-        if npc_id in GAME_STATE:
-            GAME_STATE[npc_id]["state"] = "idle"
-        return JSONResponse(
-            status_code=500,
-            content={"message": f"内部错误: 移动指令处理失败"}
-        )
\ No newline at end of file
+    return await _do_move(command.npc_id, command.target_x, command.target_y, "交互式移动指令")
@@ -0,0 +1,216 @@
+# backend/numba_astar.py (Numba JIT编译的网格A*寻路)
+#
+# 在按行位压缩的地图上直接运行的八方向A*，并借助RSR宏边跨越空矩形内部。
+# 开放列表是扁平数组上的二叉堆，
+# g值、来源格子、关闭标记都是预分配的连续数组，整个搜索循环由LLVM编译为机器码，
+# 不再为每个格子付出Python对象和字典查找的开销。
+# 内核以nogil方式编译，在线程池中运行时不会阻塞事件循环所在线程。
+# 未安装numba时同一份代码以纯Python方式执行，结果一致，仅作为开发环境的回退方案。
+
+import numpy as np
+
+try:
+    from numba import njit
+    JIT_ENABLED = True
+except ImportError:
+    JIT_ENABLED = False
+
+    def njit(*args, **kwargs):
+        """与numba.njit(...)用法兼容的空装饰器，原样返回被装饰的函数"""
+        return lambda func: func
+
+SQRT2 = np.float32(np.sqrt(2.0))
+
+
+def pack_grid_rows(grid: np.ndarray) -> np.ndarray:
+    """
+    将uint8地图网格按行压缩为uint64位图：第y行第x位为1表示该格可通行
+
+    参数:
+        grid: 地图网格（1=可通行, 0=障碍物），宽度不超过64
+    """
+    height, width = grid.shape
+    if width > 64:
+        raise ValueError(f"地图宽度{width}超过64，无法按行压缩为uint64")
+    bits = grid.astype(np.uint64) << np.arange(width, dtype=np.uint64)
+    return np.bitwise_or.reduce(bits, axis=1)
+
+
+@njit(cache=True, nogil=True, boundscheck=False)
+def _heap_push(heap_f: np.ndarray, heap_h: np.ndarray, heap_i: np.ndarray,
+               size: int, f: float, h: float, index: int) -> int:
+    """
+    将(f, h, 格子索引)压入小顶堆，返回新的堆大小
+
+    按f值排序，f相同时h更小（更接近终点）者优先，减少大片空地上等价格子的展开；
+    上浮时只移动空位，最后一次性写入，避免逐层交换三列数据
+    """
+    i = size
+    while i > 0:
+        parent = (i - 1) >> 1
+        pf = heap_f[parent]
+        if pf < f or (pf == f and heap_h[parent] <= h):
+            break
+        heap_f[i] = pf
+        heap_h[i] = heap_h[parent]
+        heap_i[i] = heap_i[parent]
+        i = parent
+    heap_f[i] = f
+    heap_h[i] = h
+    heap_i[i] = index
+    return size + 1
+
+
+@njit(cache=True, nogil=True, boundscheck=False)
+def _heap_pop(heap_f: np.ndarray, heap_h: np.ndarray, heap_i: np.ndarray, size: int):
+    """弹出堆顶元素，返回(格子索引, 新的堆大小)"""
+    top = heap_i[0]
+    size -= 1
+    # 将末尾元素从根部下沉到合适位置
+    f = heap_f[size]
+    h = heap_h[size]
+    index = heap_i[size]
+    i = 0
+    while True:
+        child = 2 * i + 1
+        if child >= size:
+            break
+        right = child + 1
+        if right < size and (heap_f[right] < heap_f[child]
+                             or (heap_f[right] == heap_f[child] and heap_h[right] < heap_h[child])):
+            child = right
+        cf = heap_f[child]
+        if f < cf or (f == cf and h <= heap_h[child]):
+            break
+        heap_f[i] = cf
+        heap_h[i] = heap_h[child]
+        heap_i[i] = heap_i[child]
+        i = child
+    heap_f[i] = f
+    heap_h[i] = h
+    heap_i[i] = index
+    return top, size
+
+
+@njit(cache=True, nogil=True, boundscheck=False)
+def _octile(dx: int, dy: int) -> float:
+    """八方向距离：相邻移动与矩形内宏边的代价都按此计算"""
+    dx = abs(dx)
+    dy = abs(dy)
+    return np.float32(dx + dy) + (SQRT2 - np.float32(2.0)) * np.float32(min(dx, dy))
+
+
+@njit(cache=True, nogil=True, boundscheck=False)
+def astar_numba(rows: np.ndarray, open_rows: np.ndarray, cell_to_rect: np.ndarray,
+                jump_offsets: np.ndarray, jump_targets: np.ndarray,
+                width: int, sy: int, sx: int, gy: int, gx: int) -> np.ndarray:
+    """
+    在RSR（矩形对称性消减）预处理后的地图上执行八方向A*寻路（允许切角，与DiagonalMovement.always一致）
+
+    空矩形内部的格子不参与展开，改由周长格子之间的宏边直接跨越矩形，最短路径长度不变。
+    返回的路径中相邻两点可能不相邻（宏边），需由调用方逐格展开
+
+    参数:
+        rows: 按行位压缩的地图（见pack_grid_rows），第y行第x位为1表示可通行
+        open_rows: 同样格式，额外去掉了矩形内部格子，普通相邻移动只会走到这些格子
+        cell_to_rect: 按y * width + x索引的所属矩形编号（障碍物为-1）
+        jump_offsets, jump_targets: 宏边邻接表（CSR格式），格子i的宏边目标为
+            jump_targets[jump_offsets[i]:jump_offsets[i + 1]]，同样按y * width + x编号
+        width: 地图宽度（网格数）
+        sy, sx: 起点的行、列
+        gy, gx: 终点的行、列
+
+    返回:
+        形状为(N, 2)的int32数组，每行为(row, col)，包含起点和终点；无可行路径时N为0
+    """
+    height = rows.shape[0]
+    cells = height * width
+    one = np.uint64(1)
+    # 终点本身是障碍物时必然不可达，无需展开整个连通区域再失败
+    if (rows[gy] >> np.uint64(gx)) & one == 0:
+        return np.empty((0, 2), dtype=np.int32)
+    start = sy * width + sx
+    goal = gy * width + gx
+    # 终点在矩形内部时不在任何邻接表中，需从同一矩形内被展开的格子单独连过去
+    goal_rect = -1
+    if (open_rows[gy] >> np.uint64(gx)) & one == 0:
+        goal_rect = cell_to_rect[goal]
+
+    g_score = np.full(cells, np.inf, dtype=np.float32)
+    came_from = np.full(cells, -1, dtype=np.int32)
+    closed = np.zeros(cells, dtype=np.bool_)
+    # 采用惰性删除：更优的g值直接重新入堆，每条有向边最多入堆一次，
+    # 容量取全部相邻边、宏边与连向终点的边数之和
+    capacity = 9 * cells + jump_targets.shape[0] + 1
+    heap_f = np.empty(capacity, dtype=np.float32)
+    heap_h = np.empty(capacity, dtype=np.float32)
+    heap_i = np.empty(capacity, dtype=np.int32)
+
+    g_score[start] = 0.0
+    size = _heap_push(heap_f, heap_h, heap_i, 0, 0.0, 0.0, start)
+    found = False
+
+    while size > 0:
+        current, size = _heap_pop(heap_f, heap_h, heap_i, size)
+        y, x = current // width, current % width
+        if closed[current]:
+            continue
+        if current == goal:
+            found = True
+            break
+        closed[current] = True
+        g_current = g_score[current]
+
+        for dy in range(-1, 2):
+            ny = y + dy
+            if ny < 0 or ny >= height:
+                continue
+            row = open_rows[ny]
+            for dx in range(-1, 2):
+                nx = x + dx
+                if (dx == 0 and dy == 0) or nx < 0 or nx >= width:
+                    continue
+                # 位测试代替二维数组访问，整张地图只有height个uint64，常驻L1缓存
+                if (row >> np.uint64(nx)) & one == 0:
+                    continue
+                neighbor = ny * width + nx
+                if closed[neighbor]:
+                    continue
+                step = SQRT2 if dx != 0 and dy != 0 else np.float32(1.0)
+                tentative = g_current + step
+                if tentative < g_score[neighbor]:
+                    g_score[neighbor] = tentative
+                    came_from[neighbor] = current
+                    h = _octile(gx - nx, gy - ny)
+                    size = _heap_push(heap_f, heap_h, heap_i, size, tentative + h, h, neighbor)
+
+        # 宏边：与终点连边共用同一段松弛逻辑，k == end时代表连向矩形内部的终点
+        end = jump_offsets[current + 1]
+        last = end + 1 if goal_rect >= 0 and cell_to_rect[current] == goal_rect else end
+        for k in range(jump_offsets[current], last):
+            neighbor = jump_targets[k] if k < end else goal
+            if closed[neighbor]:
+                continue
+            ny, nx = neighbor // width, neighbor % width
+            tentative = g_current + _octile(nx - x, ny - y)
+            if tentative < g_score[neighbor]:
+                g_score[neighbor] = tentative
+                came_from[neighbor] = current
+                h = _octile(gx - nx, gy - ny)
+                size = _heap_push(heap_f, heap_h, heap_i, size, tentative + h, h, neighbor)
+
+    if not found:
+        return np.empty((0, 2), dtype=np.int32)
+
+    # 沿来源数组从终点回溯到起点，写入预分配缓冲区后再反转
+    buffer = np.empty((cells, 2), dtype=np.int32)
+    length = 0
+    node = goal
+    while node != -1:
+        buffer[length, 0] = node // width
+        buffer[length, 1] = node % width
+        length += 1
+        if node == start:
+            break
+        node = came_from[node]
+    return buffer[:length][::-1].copy()
@@ -1,5 +1,6 @@
 # controller/controller.py (模拟控制器)
 
+import atexit
 import httpx
 import random
 import time
@@ -20,20 +21,27 @@ MAP_WIDTH = 1472
 MAP_HEIGHT = 1104
 CHARACTER_SIZE = 50  # 角色图标的尺寸，避免跑到最边缘
 
+# 全局复用一个HTTP客户端：借助keep-alive复用TCP连接，避免每条指令都重新握手
+CLIENT = httpx.Client(
+    base_url=BACKEND_URL,
+    timeout=5.0,
+    limits=httpx.Limits(max_keepalive_connections=4),
+)
+atexit.register(CLIENT.close)
+
 
 def send_move_command(npc_id: str, x: int, y: int):
     """向后端发送移动指令的函数"""
-    url = f"{BACKEND_URL}/command/move/{npc_id}"
+    path = f"/command/move/{npc_id}"
     payload = {"target_x": x, "target_y": y}
     try:
-        with httpx.Client() as client:
-            response = client.post(url, json=payload, timeout=5.0)
-            if response.status_code == 200:
-                logger.info(f"✅ 指令成功: 移动 {npc_id} 到 ({x}, {y})")
-            else:
-                logger.error(f"❌ 指令失败: {response.status_code} - {response.text}")
+        response = CLIENT.post(path, json=payload)
+        if response.status_code == 200:
+            logger.info(f"✅ 指令成功: 移动 {npc_id} 到 ({x}, {y})")
+        else:
+            logger.error(f"❌ 指令失败: {response.status_code} - {response.text}")
     except httpx.RequestError as e:
-        logger.error(f"🔌 连接错误: 无法连接到后端 {url}。请确保后端服务器正在运行。")
+        logger.error(f"🔌 连接错误: 无法连接到后端 {BACKEND_URL}{path}。请确保后端服务器正在运行。")
 
 
 def main():